@@ -3,7 +3,9 @@ from __future__ import annotations
 from dataclasses import dataclass
 from ipaddress import ip_network, IPv4Address, IPv4Network
 from collections import deque
-from typing import Iterable, Optional, Dict, Deque, Set
+from heapq import heappush, heappop
+import re
+from typing import Iterable, Optional, Deque, Dict, List, Set, Tuple
 
 @dataclass
 class Lease:
@@ -11,6 +13,8 @@ class Lease:
     ip: IPv4Address
     expiry: int  # epoch seconds or logical ticks
 
+_NONZERO_BYTE = re.compile(b"[^\x00]")
+
 class LeasePool:
     """
     Minimal DHCP-like lease allocator (core logic only).
@@ -19,26 +23,48 @@ class LeasePool:
     - No sockets, no DHCP packets. Pure allocation semantics.
 
     Rules:
-    - Pool built from IPv4Network.hosts(), minus exclusions.
+    - Pool is the IPv4Network.hosts() range minus exclusions, computed as integer
+      offsets from the network address and kept as a bitmap (bit set = free).
+    - Allocation is next-fit: the scan resumes just past the last address handed out
+      and wraps, so a released address is not reassigned until the cursor comes round.
     - A client with a valid lease gets the same IP on request/renew.
-    - Expired leases are reclaimed on `expire()` or implicitly before allocations.
+    - Every request/renew first pops the due entries at the head of the expiry
+      schedule (O(1) when nothing is due, O(k) for k due entries), which also keeps
+      the schedule bounded under repeated renews.
     """
     def __init__(self, network: str, lease_seconds: int = 3600, exclusions: Optional[Iterable[str]] = None):
         self.net: IPv4Network = ip_network(network, strict=False)
         self.lease_seconds = int(lease_seconds)
-        excl: Set[IPv4Address] = set(IPv4Address(x) for x in (exclusions or []))
-        # Default exclusion: first host as gateway if inside network host set
-        hosts = list(self.net.hosts())
-        if hosts:
-            excl.add(hosts[0])  # typical gateway convention
-        # Build available pool
-        self._available: Deque[IPv4Address] = deque(ip for ip in hosts if ip not in excl)
+        # Host offsets by integer arithmetic, same set as hosts(): /31 and /32 use every
+        # address, larger networks drop the network and broadcast addresses.
+        self._base = int(self.net.network_address)
+        self._n = self.net.num_addresses
+        first, last = (0, self._n - 1) if self._n <= 2 else (1, self._n - 2)
+        excl: Set[int] = {int(IPv4Address(x)) - self._base for x in (exclusions or [])}
+        excl.add(first)  # default exclusion: first host as gateway (typical convention)
+        # Build available pool: one bit per address offset
+        mask = ((1 << (last - first + 1)) - 1) << first
+        for off in excl:
+            if first <= off <= last:
+                mask &= ~(1 << off)
+        self._free = bytearray(mask.to_bytes((self._n + 7) // 8, "little"))
+        self._nfree = (last - first + 1) - sum(1 for off in excl if first <= off <= last)
+        self._next = 0  # next-fit cursor: offset where the next scan starts
         self._leases_by_client: Dict[str, Lease] = {}
-        self._leases_by_ip: Dict[IPv4Address, Lease] = {}
+        self._leases_by_ip: Dict[int, Lease] = {}  # keyed by offset from network address
+        # Expiry schedule of (expiry, client_id). With a fixed lease_seconds and
+        # non-decreasing `now`, expiries arrive sorted, so a FIFO suffices; an entry
+        # that would break the order (caller's clock went backwards) goes to a
+        # min-heap instead. Entries whose expiry no longer matches the live lease
+        # (renewed/released) are skipped lazily in expire().
+        self._exp_q: Deque[Tuple[int, str]] = deque()
+        self._exp_heap: List[Tuple[int, str]] = []
+        # Reclaimed Lease objects, re-initialized in place by _new_lease (no per-request allocation)
+        self._spare_leases: List[Lease] = []
 
     # ----- Introspection -----
     def available_count(self) -> int:
-        return len(self._available)
+        return self._nfree
     def active_count(self, now: Optional[int] = None) -> int:
         if now is None:
             return len(self._leases_by_client)
@@ -49,14 +75,14 @@ class LeasePool:
         """Get or allocate an IP for client_id at time `now`."""
         self.expire(now)
         lease = self._leases_by_client.get(client_id)
-        if lease and lease.expiry > now:
-            return lease.ip
+        if lease:
+            return lease.ip  # due leases were just reclaimed, so this one is live
         # allocate new
-        if not self._available:
+        off = self._take_offset()
+        if off is None:
             raise RuntimeError("No available IPs")
-        ip = self._available.popleft()
-        new_lease = Lease(client_id=client_id, ip=ip, expiry=now + self.lease_seconds)
-        self._commit_lease(new_lease)
+        ip = IPv4Address(self._base + off)
+        self._commit_lease(self._new_lease(client_id, ip, now + self.lease_seconds))
         return ip
 
     def renew(self, client_id: str, now: int) -> IPv4Address:
@@ -65,29 +91,80 @@ class LeasePool:
         lease = self._leases_by_client.get(client_id)
         if lease and lease.expiry > now:
             lease.expiry = now + self.lease_seconds
+            self._schedule_expiry(lease.expiry, client_id)
             return lease.ip
         return self.request(client_id, now)
 
     def release(self, client_id: str) -> None:
         lease = self._leases_by_client.pop(client_id, None)
         if lease:
-            self._leases_by_ip.pop(lease.ip, None)
-            self._available.append(lease.ip)
+            self._reclaim(lease)
 
     def expire(self, now: int) -> int:
-        """Reclaim all leases with expiry <= now. Return count."""
-        expired_clients = [cid for cid, L in self._leases_by_client.items() if L.expiry <= now]
-        for cid in expired_clients:
-            lease = self._leases_by_client.pop(cid)
-            self._leases_by_ip.pop(lease.ip, None)
-            self._available.append(lease.ip)
-        return len(expired_clients)
+        """Reclaim all leases with expiry <= now. Return count. Runs at the start of request/renew."""
+        q, heap = self._exp_q, self._exp_heap
+        removed = 0
+        while q and q[0][0] <= now:
+            removed += self._expire_entry(*q.popleft())
+        while heap and heap[0][0] <= now:
+            removed += self._expire_entry(*heappop(heap))
+        return removed
 
     # ----- Helpers -----
     def _commit_lease(self, lease: Lease) -> None:
         # safety: remove any stale inverse mapping
-        stale = self._leases_by_ip.get(lease.ip)
+        off = int(lease.ip) - self._base
+        stale = self._leases_by_ip.get(off)
         if stale:
             self._leases_by_client.pop(stale.client_id, None)
         self._leases_by_client[lease.client_id] = lease
-        self._leases_by_ip[lease.ip] = lease
+        self._leases_by_ip[off] = lease
+        self._schedule_expiry(lease.expiry, lease.client_id)
+
+    def _schedule_expiry(self, expiry: int, client_id: str) -> None:
+        q = self._exp_q
+        if not q or q[-1][0] <= expiry:
+            q.append((expiry, client_id))
+        else:
+            heappush(self._exp_heap, (expiry, client_id))
+
+    def _expire_entry(self, expiry: int, client_id: str) -> int:
+        lease = self._leases_by_client.get(client_id)
+        if lease and lease.expiry == expiry:
+            del self._leases_by_client[client_id]
+            self._reclaim(lease)
+            return 1
+        return 0
+
+    def _reclaim(self, lease: Lease) -> None:
+        # caller has already removed `lease` from _leases_by_client
+        off = int(lease.ip) - self._base
+        if self._leases_by_ip.pop(off, None) is not None:
+            self._free[off >> 3] |= 1 << (off & 7)
+            self._nfree += 1
+            self._spare_leases.append(lease)
+
+    def _new_lease(self, client_id: str, ip: IPv4Address, expiry: int) -> Lease:
+        if not self._spare_leases:
+            return Lease(client_id=client_id, ip=ip, expiry=expiry)
+        lease = self._spare_leases.pop()
+        lease.client_id, lease.ip, lease.expiry = client_id, ip, expiry
+        return lease
+
+    def _take_offset(self) -> Optional[int]:
+        """Clear and return the first free offset at or after the cursor, wrapping; None if empty."""
+        if not self._nfree:
+            return None
+        free, c = self._free, self._next
+        byte = free[c >> 3] >> (c & 7)
+        if byte:
+            off = c + (byte & -byte).bit_length() - 1
+        else:
+            # first non-zero byte past the cursor's byte, else from the start (C-level search)
+            m = _NONZERO_BYTE.search(free, (c >> 3) + 1) or _NONZERO_BYTE.search(free)
+            i = m.start()
+            off = i * 8 + (free[i] & -free[i]).bit_length() - 1
+        free[off >> 3] &= ~(1 << (off & 7)) & 0xFF
+        self._nfree -= 1
+        self._next = (off + 1) % (len(free) * 8)
+        return off
@@ -0,0 +1,25 @@
+
+"""
+Optional Numba-compiled inner loops for NATTable.
+`mark_expired` is None when numba (and numpy) are not installed; callers keep a
+pure-Python path, so the package stays standard-library only.
+"""
+from __future__ import annotations
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:  # optional acceleration only
+    mark_expired = None
+else:
+    @njit(cache=True)
+    def mark_expired(proto, ts, limit):
+        """Indices of live rows (proto != 0) whose timestamp is <= limit."""
+        n = proto.shape[0]
+        out = np.empty(n, dtype=np.int64)
+        k = 0
+        for i in range(n):
+            if proto[i] != 0 and ts[i] <= limit:
+                out[k] = i
+                k += 1
+        return out[:k]
@@ -1,90 +1,604 @@
 
 from __future__ import annotations
-from dataclasses import dataclass
+from array import array
+from functools import lru_cache
 from ipaddress import IPv4Address
-from typing import Dict, Optional, Tuple, Iterable
+from itertools import product
+import random
+import threading
+import time
+from types import MethodType
+from typing import Callable, Dict, List, Optional, Tuple, Iterable
 
-Key = Tuple[str, str, int]  # (proto, internal_ip, internal_port)
+try:
+    import numpy as _np
+except ImportError:  # optional: only vectorizes full-table passes
+    _np = None
 
-@dataclass
-class Mapping:
-    proto: str
-    internal_ip: str
-    internal_port: int
-    external_port: int
-    last_seen: int  # timestamp / ticks
+from ._kernels import mark_expired as _jit_mark_expired
+
+Key = Tuple[int, int, int]  # (proto_id, internal_ip as uint32, internal_port)
+
+# Internally a key is packed into one 64-bit word: proto_id | ip_u32 << 16 | port << 48,
+# so the index hashes a single int and each row stores 8 flat bytes for it.
+def _unpack(packed: int) -> Key:
+    return (packed & 0xFFFF, (packed >> 16) & 0xFFFFFFFF, packed >> 48)
+
+_WORD_BITS = 64
+
+# Port ranges of at most one word get an allocator generated per (pmin, nports):
+# the bitmap is a single small int and the range constants are baked into the code.
+_SMALL_ALLOC_SRC = '''
+def _alloc_port(self):
+    b = self._used
+    if b == {full:#x}:
+        raise RuntimeError("No free NAT ports available")
+    r = self._rng.randrange({nports})
+    x = b >> r
+    off = r + (~x & (x + 1)).bit_length() - 1
+    if off >= {nports}:
+        off = (~b & (b + 1)).bit_length() - 1
+    self._used = b | (1 << off)
+    self._nfree -= 1
+    return {pmin} + off
+
+def _free_port(self, port):
+    self._used &= ~(1 << (port - {pmin}))
+    self._nfree += 1
+'''
+
+@lru_cache(maxsize=None)
+def _small_range_allocator(pmin: int, nports: int):
+    src = _SMALL_ALLOC_SRC.format(pmin=pmin, nports=nports, full=(1 << nports) - 1)
+    ns: Dict[str, object] = {}
+    exec(compile(src, "<nat small-range allocator %d+%d>" % (pmin, nports), "exec"), ns)
+    return ns["_alloc_port"], ns["_free_port"]
+
+# Two-level hashed timing wheel, 1 tick = 1 time unit of `now`.
+# Level 0 covers the next WHEEL_SLOTS ticks; level 1 covers WHEEL_SLOTS**2 ticks in
+# WHEEL_SLOTS-tick blocks and is cascaded into level 0 at each block boundary.
+WHEEL_BITS = 8
+WHEEL_SLOTS = 1 << WHEEL_BITS
+_WHEEL_MASK = WHEEL_SLOTS - 1
+_WHEEL_SPAN = WHEEL_SLOTS * WHEEL_SLOTS
+
+# last_seen is stored as a 16-bit offset from the table epoch
+_TS_MAX = 0xFFFF
+
+# IANA protocol numbers; id 0 is reserved as the free-row marker.
+_PROTO_IDS: Dict[str, int] = {"icmp": 1, "tcp": 6, "udp": 17, "sctp": 132}
+_PROTO_NAMES: Dict[int, str] = {v: k for k, v in _PROTO_IDS.items()}
+# Any-case spelling -> id, so the hot path resolves "tcp"/"TCP"/"Tcp" without str.lower()
+_PROTO_NORM: Dict[str, int] = {
+    "".join(chars): pid
+    for name, pid in _PROTO_IDS.items()
+    for chars in product(*((c, c.upper()) for c in name))
+}
+
+# Other names get per-table ids from here up, disjoint from IANA numbers 0..255
+_DYN_PROTO_BASE = 0x100
+
+# str <-> uint32 address memos. Hot paths call .get() first and only fall back to
+# the parsing helpers on a miss, which is cheaper than an lru_cache wrapper per call.
+_IP_CACHE_MAX = 1 << 16
+_IP_U32: Dict[str, int] = {}
+_IP_STR: Dict[int, str] = {}
+
+def _ip_u32(ip: str) -> int:
+    if len(_IP_U32) >= _IP_CACHE_MAX:
+        _IP_U32.clear()
+    u = _IP_U32[ip] = int(IPv4Address(ip))
+    return u
+
+def _ip_str(ip: int) -> str:
+    if len(_IP_STR) >= _IP_CACHE_MAX:
+        _IP_STR.clear()
+    s = _IP_STR[ip] = str(IPv4Address(ip))
+    return s
+
+def _stale_rows(proto, ts, limit: int) -> List[int]:
+    """Rows with proto != 0 and ts <= limit, in one pass over the two columns."""
+    if limit < 0 or not proto:
+        return []
+    limit = min(limit, _TS_MAX)
+    if _np is not None:
+        proto = _np.frombuffer(proto, dtype=_np.uint16)
+        ts = _np.frombuffer(ts, dtype=_np.uint16)
+        if _jit_mark_expired is not None:
+            return _jit_mark_expired(proto, ts, limit).tolist()
+        return _np.nonzero((proto != 0) & (ts <= limit))[0].tolist()
+    return [row for row in range(len(proto)) if proto[row] and ts[row] <= limit]
 
 class NATTable:
     """
     Minimal endpoint-independent NAT (NAPT) core.
     - Maps (proto, internal_ip, internal_port) -> (public_ip, external_port).
-    - Maintains reverse map by external_port.
-    - Expires idle mappings by `timeout` seconds unless touched.
+      Keys are held as ints (proto_id, ip_u32, port); `*_raw` methods skip the
+      str conversions for callers that already have header fields as ints.
+      Names and numeric strings map to IANA numbers; other names get table-local
+      ids above 255, registered only by translate_out (lookups never add names).
+    - Maintains reverse map by external_port (a fixed array over the port range).
+    - Expires idle mappings by `timeout` seconds unless touched; lookups treat idle
+      mappings as absent, so `expire()` is only needed for bulk cleanup.
+    - Port occupancy is a 1-bit-per-port bitmap; each scan starts at a random port
+      (`seed` for reproducibility), so external ports are not predictable. Ranges of
+      up to 64 ports use a generated allocator specialized to the range.
+    - Mappings are rows in parallel typed arrays (struct-of-arrays); both maps hold
+      row indices, so full-table passes scan flat arrays rather than objects.
+    - With `threadsafe=True`, public ops are serialized by one table lock, so the table
+      may be shared between threads, and `start_reaper()` may sweep idle mappings on a
+      daemon thread. By default there is no lock and no per-op locking cost.
     - No packet handling; pure translation state + decisions.
     """
-    def __init__(self, public_ip: str, port_range: Tuple[int, int] = (30000, 60000), timeout: int = 60):
+    def __init__(self, public_ip: str, port_range: Tuple[int, int] = (30000, 60000), timeout: int = 60,
+                 seed: Optional[int] = None, threadsafe: bool = False):
         self.public_ip = str(IPv4Address(public_ip))
         self.pmin, self.pmax = port_range
         assert 1 <= self.pmin < self.pmax <= 65535
         self.timeout = int(timeout)
-        self._int2ext: Dict[Key, Mapping] = {}
-        self._ext2int: Dict[int, Mapping] = {}
+        assert 0 < self.timeout <= _TS_MAX  # live timestamps must fit the 16-bit window
+        self._int2ext: Dict[int, int] = {}  # packed key -> row
+        # Reverse map as a fixed array: row index per port offset, -1 = unmapped.
+        # Sized once for the whole range, so bursts of new mappings never rehash it.
+        self._ext2int = array("i", [-1]) * (self.pmax - self.pmin + 1)
+        # Row storage, one column per field; freed rows are recycled LIFO
+        self._proto = array("H")    # proto id; 0 marks a free row
+        self._eport = array("H")    # external_port
+        self._ts = array("H")       # last_seen - epoch
+        self._keys = array("Q")     # packed _int2ext key, for reverse lookups
+        self._free_rows: List[int] = []
+        # Table-local ids for protocol names outside _PROTO_IDS
+        self._dyn_ids: Dict[str, int] = {}
+        self._dyn_names: List[str] = []
+        # packed key -> (proto name, ip str, port) memo for translate_in; per table,
+        # since ids above 255 name different protocols in different tables
+        self._key_strs: Dict[int, Tuple[str, str, int]] = {}
+        self._epoch: Optional[int] = None  # base for 16-bit timestamps; set on first mapping
+        # Port bitmap over [pmin, pmax]: bit set = port in use.
+        nports = self.pmax - self.pmin + 1
+        self._nfree = nports
+        self._rng = random.Random(seed)
+        if nports <= _WORD_BITS:
+            # specialized: one-int bitmap, allocator generated for this exact range
+            self._used = 0
+            alloc, free = _small_range_allocator(self.pmin, nports)
+            self._alloc_port = MethodType(alloc, self)
+            self._free_port = MethodType(free, self)
+        else:
+            # generic: bytearray padded to whole 64-bit words; padding bits are
+            # pre-set so the scan never hands them out
+            self._nwords = (nports + _WORD_BITS - 1) // _WORD_BITS
+            self._bits = bytearray(self._nwords * 8)
+            for off in range(nports, self._nwords * _WORD_BITS):
+                self._bits[off >> 3] |= 1 << (off & 7)
+        # Timing wheel of row indices, at most one entry per row (`_slotted` flag).
+        # Touches only bump the timestamp; expire() re-slots a row touched since.
+        # A freed row keeps its entry, which is skipped or inherited on reuse.
+        self._wheel: List[List[int]] = [[] for _ in range(WHEEL_SLOTS)]
+        self._wheel2: List[List[int]] = [[] for _ in range(WHEEL_SLOTS)]
+        self._slotted = bytearray()
+        self._cursor: Optional[int] = None  # next tick to process; set on first mapping
+        # fixed for the table's lifetime, so an op never sees it swapped mid-call
+        self._lock: Optional[threading.Lock] = threading.Lock() if threadsafe else None
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_stop = threading.Event()
 
     # ----- Core ops -----
+    # With threadsafe=True, public ops hold self._lock around the _-prefixed helpers,
+    # which never take it; otherwise _lock is None and the ops call the helpers directly.
     def translate_out(self, proto: str, internal_ip: str, internal_port: int, now: int) -> Tuple[str, int]:
         """
         For outbound traffic: get or allocate an external port.
         Returns (public_ip, external_port).
         """
-        key: Key = (proto.lower(), internal_ip, int(internal_port))
-        m = self._int2ext.get(key)
-        if m:
-            m.last_seen = now
-            return (self.public_ip, m.external_port)
-        # allocate new port
-        port = self._alloc_port()
-        mapping = Mapping(proto=key[0], internal_ip=key[1], internal_port=key[2], external_port=port, last_seen=now)
-        self._int2ext[key] = mapping
-        self._ext2int[port] = mapping
-        return (self.public_ip, port)
+        ip = _IP_U32.get(internal_ip)
+        if ip is None:
+            ip = _ip_u32(internal_ip)
+        internal_port = int(internal_port)
+        if not 0 <= internal_port <= 0xFFFF:
+            raise ValueError("internal_port must be a uint16")
+        rest = ip << 16 | internal_port << 48  # packed key without proto id
+        pid = _PROTO_NORM.get(proto)
+        if self._lock is None:
+            return self._translate_out((pid or self._proto_id(proto)) | rest, now)
+        with self._lock:  # unseen names are registered under the lock too
+            return self._translate_out((pid or self._proto_id(proto)) | rest, now)
+
+    def translate_out_raw(self, proto_id: int, internal_ip: int, internal_port: int, now: int) -> Tuple[str, int]:
+        """`translate_out` with proto as an IANA number (1..255) and internal_ip as a uint32."""
+        internal_port = int(internal_port)
+        # validate before packing: out-of-range fields would spill into neighbouring
+        # fields of the key and could match another mapping
+        if not 0 < proto_id <= 0xFF:
+            raise ValueError("proto_id must be in 1..255")
+        if not (0 <= internal_ip <= 0xFFFFFFFF and 0 <= internal_port <= 0xFFFF):
+            raise ValueError("internal_ip must be a uint32, internal_port a uint16")
+        key = proto_id | internal_ip << 16 | internal_port << 48  # packed key
+        if self._lock is None:
+            return self._translate_out(key, now)
+        with self._lock:
+            return self._translate_out(key, now)
 
     def translate_in(self, external_port: int, now: Optional[int] = None) -> Optional[Tuple[str, str, int]]:
-        """For inbound traffic: look up internal tuple by external port. Optionally touch last_seen."""
-        m = self._ext2int.get(int(external_port))
-        if not m:
+        """
+        For inbound traffic: look up internal tuple by external port.
+        With `now`, an idle-expired mapping is reclaimed and treated as absent; otherwise it is touched.
+        """
+        if self._lock is None:
+            key = self._translate_in(external_port, now)
+        else:
+            with self._lock:
+                key = self._translate_in(external_port, now)
+        if key < 0:
             return None
-        if now is not None:
-            m.last_seen = now
-        return (m.proto, m.internal_ip, m.internal_port)
+        out = self._key_strs.get(key)
+        if out is None:
+            out = self._str_key(key)
+        return out
+
+    def translate_in_raw(self, external_port: int, now: Optional[int] = None) -> Optional[Key]:
+        """`translate_in` returning the (proto_id, ip_u32, port) key without str conversion."""
+        if self._lock is None:
+            key = self._translate_in(external_port, now)
+        else:
+            with self._lock:
+                key = self._translate_in(external_port, now)
+        return None if key < 0 else _unpack(key)
 
     def touch_by_internal(self, proto: str, internal_ip: str, internal_port: int, now: int) -> bool:
-        key: Key = (proto.lower(), internal_ip, int(internal_port))
-        m = self._int2ext.get(key)
-        if not m:
+        key = self._lookup_key(proto, internal_ip, internal_port)
+        if key is None:
             return False
-        m.last_seen = now
-        return True
+        if self._lock is None:
+            return self._touch_key(key, now)
+        with self._lock:
+            return self._touch_key(key, now)
 
     def release(self, proto: str, internal_ip: str, internal_port: int) -> bool:
         """Remove mapping if exists; return True if removed."""
-        key: Key = (proto.lower(), internal_ip, int(internal_port))
-        m = self._int2ext.pop(key, None)
-        if not m:
+        key = self._lookup_key(proto, internal_ip, internal_port)
+        if key is None:
             return False
-        self._ext2int.pop(m.external_port, None)
-        return True
+        if self._lock is None:
+            return self._release_key(key)
+        with self._lock:
+            return self._release_key(key)
+
+    def release_by_port(self, external_port: int) -> bool:
+        """Remove the mapping holding `external_port`; return True if removed."""
+        if self._lock is None:
+            return self._release_port(external_port)
+        with self._lock:
+            return self._release_port(external_port)
 
     def expire(self, now: int) -> int:
-        """Evict idle mappings older than timeout. Return count removed."""
-        to_remove = [port for port, m in self._ext2int.items() if now - m.last_seen >= self.timeout]
-        for port in to_remove:
-            m = self._ext2int.pop(port)
-            self._int2ext.pop((m.proto, m.internal_ip, m.internal_port), None)
-        return len(to_remove)
+        """
+        Evict idle mappings older than timeout. Return count removed.
+        Optional bulk cleanup: lookups already treat idle mappings as absent.
+        """
+        if self._lock is None:
+            return self._expire(now)
+        with self._lock:
+            return self._expire(now)
+
+    # ----- Background reaper -----
+    def start_reaper(self, interval: float, clock: Callable[[], int] = lambda: int(time.monotonic())) -> None:
+        """
+        Sweep idle mappings every `interval` seconds on a daemon thread.
+        `clock` must return the same time base callers pass as `now`.
+        """
+        if self._lock is None:
+            raise RuntimeError("start_reaper() needs a table built with threadsafe=True")
+        if self._reaper is not None:
+            raise RuntimeError("reaper already running")
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, args=(interval, clock),
+                                        name="nat-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        if self._reaper is None:
+            return
+        self._reaper_stop.set()
+        self._reaper.join()
+        self._reaper = None
+
+    def _reap_loop(self, interval: float, clock: Callable[[], int]) -> None:
+        while not self._reaper_stop.wait(interval):
+            self._reap(clock())
+
+    def _reap(self, now: int) -> int:
+        """
+        One sweep: copy the proto/ts columns under the lock, find candidates without
+        it, then release each one that is still idle when rechecked under the lock.
+        """
+        with self._lock:
+            if self._epoch is None:
+                return 0
+            proto, ts, epoch = self._proto[:], self._ts[:], self._epoch
+        removed = 0
+        for row in _stale_rows(proto, ts, now - self.timeout - epoch):
+            with self._lock:
+                # touched or reused since the snapshot: keep it
+                if self._proto[row] and self._last_seen(row) + self.timeout <= now:
+                    removed += self._release_port(self._eport[row])
+        return removed
 
     # ----- Helpers -----
+    def _translate_out(self, key: int, now: int) -> Tuple[str, int]:
+        """Get or map the packed, already validated `key`."""
+        row = self._int2ext.get(key)
+        if row is not None:
+            ts = self._ts
+            rel = now - self._epoch
+            if rel - ts[row] < self.timeout:
+                # hit: write the timestamp in place; only a 16-bit overflow needs _touch
+                if 0 <= rel <= _TS_MAX:
+                    ts[row] = rel
+                else:
+                    self._touch(row, now)
+                return (self.public_ip, self._eport[row])
+            self._drop(row, key)  # idle past timeout: reclaim inline, then map afresh
+        # allocate new port; sweep only when the pool looks exhausted
+        if not self._nfree:
+            self._expire(now)
+        port = self._alloc_port()
+        if self._cursor is None:
+            self._cursor = self._epoch = now
+        row = self._new_row(key, port, now)
+        self._int2ext[key] = row
+        self._ext2int[port - self.pmin] = row
+        return (self.public_ip, port)
+
+    def _translate_in(self, external_port: int, now: Optional[int]) -> int:
+        """Packed key mapped at `external_port`, or -1."""
+        off = int(external_port) - self.pmin
+        row = self._ext2int[off] if 0 <= off < len(self._ext2int) else -1
+        if row < 0:
+            return -1
+        key = self._keys[row]
+        if now is not None:
+            ts = self._ts
+            rel = now - self._epoch
+            if rel - ts[row] >= self.timeout:
+                self._drop(row, key)
+                return -1
+            if 0 <= rel <= _TS_MAX:
+                ts[row] = rel
+            else:
+                self._touch(row, now)
+        return key
+
+    def _lookup_key(self, proto: str, internal_ip: str, internal_port: int) -> Optional[int]:
+        """Packed key for a lookup, or None if the protocol name was never mapped here."""
+        pid = _PROTO_NORM.get(proto) or self._find_proto_id(proto)
+        if pid is None:
+            return None
+        ip = _IP_U32.get(internal_ip)
+        if ip is None:
+            ip = _ip_u32(internal_ip)
+        return pid | ip << 16 | int(internal_port) << 48
+
+    def _touch_key(self, key: int, now: int) -> bool:
+        row = self._int2ext.get(key)
+        if row is None:
+            return False
+        ts = self._ts
+        rel = now - self._epoch
+        if rel - ts[row] >= self.timeout:
+            self._drop(row, key)
+            return False
+        if 0 <= rel <= _TS_MAX:
+            ts[row] = rel
+        else:
+            self._touch(row, now)
+        return True
+
+    def _release_key(self, key: int) -> bool:
+        row = self._int2ext.get(key)
+        if row is None:
+            return False
+        self._drop(row, key)
+        return True
+
+    def _release_port(self, external_port: int) -> bool:
+        off = int(external_port) - self.pmin
+        row = self._ext2int[off] if 0 <= off < len(self._ext2int) else -1
+        if row < 0:
+            return False
+        self._drop(row, self._keys[row])
+        return True
+
+    def _expire(self, now: int) -> int:
+        if self._cursor is None or now < self._cursor:
+            return 0
+        removed = 0
+        if not self._int2ext:
+            # nothing live: any wheel entries belong to free rows
+            self._clear_wheel()
+            self._cursor = now + 1
+            return 0
+        elif now - self._cursor >= _WHEEL_SPAN:
+            # time jumped past the whole wheel: one flat pass over the timestamp
+            # column, then re-slot the survivors
+            self._clear_wheel()
+            self._cursor = now + 1
+            for row in self._expired_rows(now):
+                self._drop(row, self._keys[row])
+                removed += 1
+            for row in self._int2ext.values():
+                self._schedule(row, self._epoch + self._ts[row] + self.timeout)
+            return removed
+        while self._cursor <= now:
+            t = self._cursor
+            if not t & _WHEEL_MASK:
+                i = (t >> WHEEL_BITS) & _WHEEL_MASK
+                bucket, self._wheel2[i] = self._wheel2[i], []
+                for row in bucket:
+                    if self._proto[row]:
+                        self._place(row, self._last_seen(row) + self.timeout)
+                    else:
+                        self._slotted[row] = 0  # released since it was scheduled
+            bucket, self._wheel[t & _WHEEL_MASK] = self._wheel[t & _WHEEL_MASK], []
+            for row in bucket:
+                removed += self._expire_one(row, now)
+            self._cursor = t + 1
+        return removed
+
+    def _proto_id(self, proto: str) -> int:
+        """
+        Id for a protocol name: the IANA number for known names and numeric strings,
+        otherwise a table-local id above 255, so names never alias raw numbers.
+        Registers unseen names; only translate_out may create them.
+        """
+        pid = self._find_proto_id(proto)
+        if pid is None:
+            name = proto.lower()
+            pid = _DYN_PROTO_BASE + len(self._dyn_names)
+            if pid > 0xFFFF:
+                raise ValueError("Too many distinct NAT protocols")
+            self._dyn_ids[name] = pid
+            self._dyn_names.append(name)
+        return pid
+
+    def _find_proto_id(self, proto: str) -> Optional[int]:
+        """`_proto_id` for lookups: None for a name this table has not registered."""
+        name = proto.lower()
+        if name.isascii() and name.isdigit():
+            pid = int(name)
+            if not 0 < pid <= 0xFF:
+                raise ValueError("numeric proto must be in 1..255")
+            return pid
+        return self._dyn_ids.get(name)
+
+    def _str_key(self, key: int) -> Tuple[str, str, int]:
+        if len(self._key_strs) >= _IP_CACHE_MAX:
+            self._key_strs.clear()
+        pid, ip, port = _unpack(key)
+        out = self._key_strs[key] = (self._proto_name(pid), _IP_STR.get(ip) or _ip_str(ip), port)
+        return out
+
+    def _proto_name(self, pid: int) -> str:
+        if pid >= _DYN_PROTO_BASE:
+            return self._dyn_names[pid - _DYN_PROTO_BASE]
+        return _PROTO_NAMES.get(pid) or str(pid)
+
     def _alloc_port(self) -> int:
-        for p in range(self.pmin, self.pmax + 1):
-            if p not in self._ext2int:
-                return p
-        raise RuntimeError("No free NAT ports available")
+        if not self._nfree:
+            raise RuntimeError("No free NAT ports available")
+        bits, nwords = self._bits, self._nwords
+        # Start at a random port, scan upward for a zero bit, wrap to the start if none
+        r = self._rng.randrange(len(self._ext2int))
+        w, b = r >> 6, r & (_WORD_BITS - 1)
+        word = int.from_bytes(bits[w * 8:w * 8 + 8], "little") >> b
+        off = b + (~word & (word + 1)).bit_length() - 1
+        if off < _WORD_BITS:
+            off += w * _WORD_BITS
+        else:
+            # Rest of the start word is full: view the words after it as one big int
+            # and take its lowest zero bit with the same trick, a few C-level ops
+            # instead of a Python loop. Nothing past the end: wrap to the start.
+            tail = int.from_bytes(bits[w * 8 + 8:], "little")
+            off = (w + 1) * _WORD_BITS + (~tail & (tail + 1)).bit_length() - 1
+            if off >= nwords * _WORD_BITS:
+                head = int.from_bytes(bits[:w * 8 + 8], "little")
+                off = (~head & (head + 1)).bit_length() - 1
+        bits[off >> 3] |= 1 << (off & 7)
+        self._nfree -= 1
+        return self.pmin + off
+
+    def _free_port(self, port: int) -> None:
+        off = port - self.pmin
+        self._bits[off >> 3] &= ~(1 << (off & 7)) & 0xFF
+        self._nfree += 1
+
+    def _new_row(self, key: int, external_port: int, now: int) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self._proto[row] = key & 0xFFFF
+            self._eport[row] = external_port
+            self._keys[row] = key
+        else:
+            row = len(self._proto)
+            self._proto.append(key & 0xFFFF)
+            self._eport.append(external_port)
+            self._ts.append(0)
+            self._keys.append(key)
+            self._slotted.append(0)
+        self._touch(row, now)
+        if not self._slotted[row]:
+            # a recycled row may still hold a wheel entry; its slot is never later
+            # than this mapping's deadline, so it is simply inherited
+            self._schedule(row, now + self.timeout)
+        return row
+
+    def _drop(self, row: int, key: int) -> None:
+        del self._int2ext[key]
+        external_port = self._eport[row]
+        self._ext2int[external_port - self.pmin] = -1
+        self._free_port(external_port)
+        self._proto[row] = 0  # row is free
+        self._keys[row] = 0
+        self._free_rows.append(row)
+
+    def _last_seen(self, row: int) -> int:
+        return self._epoch + self._ts[row]
+
+    def _expired_rows(self, now: int) -> List[int]:
+        """Live rows idle for >= timeout."""
+        return _stale_rows(self._proto, self._ts, now - self.timeout - self._epoch)
+
+    def _touch(self, row: int, now: int) -> None:
+        rel = now - self._epoch
+        if rel > _TS_MAX:
+            self._rebase(now)
+            rel = now - self._epoch
+        self._ts[row] = max(rel, 0)
+
+    def _rebase(self, now: int) -> None:
+        """
+        Move the timestamp epoch to `now - timeout` and re-encode live rows against it.
+        Rows older than the new epoch are clamped to it; they are idle past timeout either way.
+        """
+        epoch = now - self.timeout
+        shift = epoch - self._epoch
+        if _np is not None and self._ts:
+            ts = _np.frombuffer(self._ts, dtype=_np.uint16)
+            ts[:] = _np.clip(ts.astype(_np.int64) - shift, 0, None)
+        else:
+            self._ts = array("H", [t - shift if t > shift else 0 for t in self._ts])
+        self._epoch = epoch
+
+    def _schedule(self, row: int, deadline: int) -> None:
+        self._slotted[row] = 1
+        self._place(row, deadline)
+
+    def _place(self, row: int, deadline: int) -> None:
+        delta = deadline - self._cursor
+        if delta < WHEEL_SLOTS:
+            # overdue deadlines land in the cursor slot and are drained on the next tick
+            self._wheel[max(deadline, self._cursor) & _WHEEL_MASK].append(row)
+            return
+        if delta >= _WHEEL_SPAN:
+            # beyond the horizon: park in the farthest block, re-slotted on cascade
+            deadline = self._cursor + _WHEEL_SPAN - WHEEL_SLOTS
+        self._wheel2[(deadline >> WHEEL_BITS) & _WHEEL_MASK].append(row)
+
+    def _expire_one(self, row: int, now: int) -> int:
+        if not self._proto[row]:
+            self._slotted[row] = 0  # released since it was scheduled
+            return 0
+        deadline = self._epoch + self._ts[row] + self.timeout
+        if deadline > now:
+            self._schedule(row, deadline)  # touched: move to its current slot
+            return 0
+        self._drop(row, self._keys[row])
+        self._slotted[row] = 0
+        return 1
+
+    def _clear_wheel(self) -> None:
+        for b in self._wheel:
+            b.clear()
+        for b in self._wheel2:
+            b.clear()
+        self._slotted[:] = bytes(len(self._slotted))
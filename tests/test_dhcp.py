@@ -28,3 +28,54 @@ def test_expiry_reclaims_addresses():
     # Next client can reuse the single available IP
     ip2 = lp.request("c2", now=12)
     assert ip2 == ip
+
+def test_next_fit_allocation_and_large_pool():
+    lp = LeasePool("10.1.0.0/16", lease_seconds=100, exclusions=["10.1.0.2"])
+    assert lp.available_count() == 65534 - 2  # minus gateway .0.1 and the exclusion
+    assert lp.request("a", now=0) == IPv4Address("10.1.0.3")
+    assert lp.request("b", now=0) == IPv4Address("10.1.0.4")
+    lp.release("a")
+    # a released address is not handed straight back out
+    assert lp.request("c", now=0) == IPv4Address("10.1.0.5")
+    assert lp.available_count() == 65534 - 4
+
+def test_released_address_reused_after_cursor_wraps():
+    lp = LeasePool("10.0.0.0/28", lease_seconds=100)  # pool .2-.14
+    ips = [lp.request("c%d" % i, now=0) for i in range(12)]  # .2-.13
+    lp.release("c0")
+    lp.release("c5")
+    assert lp.request("x", now=0) == IPv4Address("10.0.0.14")
+    assert lp.request("y", now=0) == ips[0]  # wrapped to the start
+    assert lp.request("z", now=0) == ips[5]
+    assert lp.available_count() == 0
+
+def test_renewed_lease_survives_original_expiry():
+    lp = LeasePool("10.0.0.0/29", lease_seconds=10)
+    ip = lp.request("c1", now=0)
+    lp.request("c2", now=0)
+    assert lp.renew("c1", now=5) == ip  # expiry 10 -> 15
+    assert lp.expire(now=10) == 1       # only c2
+    assert lp.active_count() == 1
+    assert lp.expire(now=15) == 1
+    assert lp.active_count() == 0
+
+def test_expired_leases_reclaimed_without_explicit_expire():
+    lp = LeasePool("10.0.0.0/29", lease_seconds=10)  # pool .2-.6
+    ips = [lp.request("c%d" % i, now=0) for i in range(5)]
+    assert lp.available_count() == 0
+    # c0 asks again after expiry: its old lease is reclaimed inline
+    assert lp.request("c0", now=20) == ips[0]
+    # exhausted pool falls back to a sweep of the other expired leases
+    assert lp.request("new", now=20) in ips[1:]
+    assert lp.active_count() == 2
+
+def test_repeated_renews_keep_expiry_schedule_bounded():
+    lp = LeasePool("10.2.0.0/16", lease_seconds=10)
+    clients = ["c%d" % i for i in range(10)]
+    for c in clients:
+        lp.request(c, now=0)
+    for t in range(1, 10001):
+        lp.renew(clients[t % 10], now=t)
+    assert lp.active_count() == 10
+    # at most one live entry per renew inside the last lease window, plus the initial ones
+    assert len(lp._exp_q) + len(lp._exp_heap) <= 10 + lp.lease_seconds
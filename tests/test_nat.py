@@ -1,4 +1,9 @@
-
+from array import array
+from ipaddress import IPv4Address
+import random
+import time
+import pytest
+import nat.nat_table as nt
 from nat.nat_table import NATTable
 
 def test_nat_translation_and_reverse():
@@ -30,3 +35,197 @@ def test_port_pool_exhaustion():
         assert False, "Expected exhaustion"
     except RuntimeError:
         assert True
+
+def test_released_port_is_reused():
+    nat = NATTable(public_ip="198.51.100.7", port_range=(50000,50001), timeout=60)
+    _, p1 = nat.translate_out("udp", "10.0.0.2", 1000, now=0)
+    nat.translate_out("udp", "10.0.0.3", 1001, now=0)
+    assert nat.release("udp", "10.0.0.2", 1000)
+    assert not nat.release("udp", "10.0.0.2", 1000)  # second release is a no-op
+    _, p3 = nat.translate_out("udp", "10.0.0.4", 1002, now=0)
+    assert p3 == p1
+    assert nat.translate_in(p3) == ("udp", "10.0.0.4", 1002)
+
+def test_port_allocation_is_seeded_random():
+    def ports(seed, n=20):
+        nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40999), timeout=30, seed=seed)
+        return [nat.translate_out("tcp", "192.168.0.10", 1000 + i, now=0)[1] for i in range(n)]
+    assert ports(7) == ports(7)
+    assert ports(7) != list(range(40000, 40020))
+    assert all(40000 <= p <= 40999 for p in ports(7))
+    # spread within words too: low 6 bits should not cluster near word starts
+    low = [(p - 40000) % 64 for p in ports(7, n=200)]
+    assert len(set(low)) >= 48
+    assert max(low.count(v) for v in set(low)) <= 12
+
+def test_expire_reschedules_touched_mappings():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40005), timeout=30)
+    _, port = nat.translate_out("tcp", "192.168.0.10", 12345, now=0)
+    nat.translate_out("tcp", "192.168.0.11", 12346, now=0)
+    nat.translate_in(port, now=25)          # inbound touch keeps the first mapping alive
+    assert nat.expire(now=30) == 1
+    assert nat.translate_in(port) == ("tcp", "192.168.0.10", 12345)
+    assert nat.expire(now=54) == 0
+    assert nat.expire(now=55) == 1
+    assert nat.translate_in(port) is None
+
+def test_expire_with_timeout_beyond_first_wheel_level():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40005), timeout=1000)
+    nat.translate_out("udp", "192.168.0.10", 5000, now=7)
+    nat.translate_out("udp", "192.168.0.11", 5001, now=300)
+    assert sum(nat.expire(now=t) for t in range(0, 1007, 50)) == 0
+    assert nat.expire(now=1007) == 1
+    assert nat.expire(now=10**6) == 1
+
+def test_idle_mapping_treated_as_absent_on_lookup():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40001), timeout=30)
+    _, p1 = nat.translate_out("tcp", "192.168.0.10", 1, now=0)
+    _, p2 = nat.translate_out("tcp", "192.168.0.11", 2, now=0)
+    assert nat.translate_in(p1, now=30) is None
+    assert not nat.touch_by_internal("tcp", "192.168.0.11", 2, now=30)
+    # both ports were reclaimed inline, so a full pool allocates without expire()
+    nat.translate_out("tcp", "192.168.0.12", 3, now=30)
+    nat.translate_out("tcp", "192.168.0.13", 4, now=30)
+    assert nat.expire(now=1000) == 2
+
+def test_timestamps_survive_16bit_epoch_rollover():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40005), timeout=100)
+    _, port = nat.translate_out("tcp", "192.168.0.10", 1, now=0)
+    nat.translate_out("tcp", "192.168.0.11", 2, now=0)
+    for now in range(90, 70000, 90):  # keep the first mapping alive past 2**16 ticks
+        assert nat.translate_out("tcp", "192.168.0.10", 1, now=now) == ("203.0.113.5", port)
+    assert nat.translate_in(port, now=70000) == ("tcp", "192.168.0.10", 1)
+    assert not nat.touch_by_internal("tcp", "192.168.0.11", 2, now=70000)
+    assert nat.expire(now=70099) == 0
+    assert nat.expire(now=70100) == 1
+
+def test_raw_int_keys_match_string_api():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40005), timeout=30)
+    _, port = nat.translate_out("TCP", "192.168.0.10", 12345, now=0)
+    ip_u32 = int(IPv4Address("192.168.0.10"))
+    assert nat.translate_out_raw(6, ip_u32, 12345, now=1) == ("203.0.113.5", port)
+    assert nat.translate_in_raw(port) == (6, ip_u32, 12345)
+    assert nat.translate_in(port) == ("tcp", "192.168.0.10", 12345)
+    _, gre = nat.translate_out_raw(47, ip_u32, 0, now=1)
+    assert nat.translate_in(gre) == ("47", "192.168.0.10", 0)
+    # out-of-range fields must not spill into a live mapping's packed key
+    for bad in ((6, ip_u32 + (12345 << 32), 0), (6, ip_u32, 12345 + (1 << 16)), (256, ip_u32, 12345)):
+        try:
+            nat.translate_out_raw(*bad, now=1)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+def test_small_range_allocator_covers_every_port():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40063), timeout=60, seed=3)
+    ports = {nat.translate_out("udp", "10.0.0.2", 1000 + i, now=0)[1] for i in range(64)}
+    assert ports == set(range(40000, 40064))
+    try:
+        nat.translate_out("udp", "10.0.0.2", 2000, now=0)
+        assert False, "Expected exhaustion"
+    except RuntimeError:
+        pass
+    _, p = nat.translate_out("udp", "10.0.0.2", 1005, now=1)
+    assert nat.release("udp", "10.0.0.2", 1005)
+    assert nat.translate_out("udp", "10.0.0.3", 7, now=2)[1] == p
+
+def test_background_reaper_releases_idle_mappings():
+    clock = [0]
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40100), timeout=30, threadsafe=True)
+    _, idle = nat.translate_out("tcp", "10.0.0.2", 1000, now=0)
+    _, busy = nat.translate_out("tcp", "10.0.0.3", 1001, now=0)
+    nat.touch_by_internal("tcp", "10.0.0.3", 1001, now=20)
+    nat.start_reaper(0.001, clock=lambda: clock[0])
+    try:
+        clock[0] = 40  # first idle past timeout, second touched at 20
+        deadline = time.monotonic() + 5
+        while nat.translate_in(idle) is not None and time.monotonic() < deadline:
+            time.sleep(0.001)
+    finally:
+        nat.stop_reaper()
+    assert nat.translate_in(idle) is None
+    assert nat.translate_in(busy) == ("tcp", "10.0.0.3", 1001)
+    assert nat.translate_out("tcp", "10.0.0.3", 1001, now=41)[1] == busy
+    # without a lock there is no safe way to share the table with the reaper thread
+    with pytest.raises(RuntimeError):
+        NATTable(public_ip="203.0.113.5").start_reaper(1)
+
+def test_protocol_names_never_alias_raw_numbers():
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40100), timeout=60)
+    ip = int(IPv4Address("10.0.0.1"))
+    _, raw = nat.translate_out_raw(255, ip, 5, now=0)
+    _, gre = nat.translate_out("gre", "10.0.0.1", 5, now=0)
+    assert raw != gre
+    assert nat.translate_in(raw) == ("255", "10.0.0.1", 5)
+    assert nat.translate_in(gre) == ("gre", "10.0.0.1", 5)
+    _, p47 = nat.translate_out_raw(47, ip, 6, now=0)
+    assert nat.translate_out("47", "10.0.0.1", 6, now=0)[1] == p47
+    # unknown names are table-local and unbounded by the 8-bit protocol field
+    for i in range(300):
+        nat.translate_out("p%d" % i, "10.0.0.1", 5, now=0)
+        assert nat.release("p%d" % i, "10.0.0.1", 5)  # the name stays registered
+    assert nat.translate_in(nat.translate_out("p299", "10.0.0.1", 5, now=0)[1]) == ("p299", "10.0.0.1", 5)
+    # lookups with names the table has never mapped do not register them
+    names = list(nat._dyn_names)
+    assert not nat.touch_by_internal("junk", "10.0.0.1", 5, now=0)
+    assert not nat.release("JUNK2", "10.0.0.1", 5)
+    assert nat._dyn_names == names
+    other = NATTable(public_ip="203.0.113.5", port_range=(40000,40100), timeout=60)
+    assert other.translate_out("gre", "10.0.0.1", 5, now=0)
+
+def test_multiword_range_hands_out_every_port_once():
+    # 200 ports = four bitmap words, the last one partial; filling to the end
+    # exercises the full-start-word tail scan and the wrap to the head words
+    for seed in range(10):
+        nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40199), timeout=60, seed=seed)
+        ports = [nat.translate_out("udp", "10.0.0.2", 1000 + i, now=0)[1] for i in range(200)]
+        assert sorted(ports) == list(range(40000, 40200))
+        try:
+            nat.translate_out("udp", "10.0.0.2", 2000, now=0)
+            assert False, "Expected exhaustion"
+        except RuntimeError:
+            pass
+        for i in (0, 63, 64, 199):
+            assert nat.release("udp", "10.0.0.2", 1000 + i)
+        again = {nat.translate_out("udp", "10.0.0.3", i, now=0)[1] for i in range(4)}
+        assert again == {ports[i] for i in (0, 63, 64, 199)}
+
+def _rebase_then_jump():
+    # staggered touches up to a 16-bit overflow (epoch rebase re-encodes the other live
+    # rows), then expiries across gaps wider than the timing wheel (flat column pass)
+    nat = NATTable(public_ip="203.0.113.5", port_range=(40000,40099), timeout=100)
+    ports = [nat.translate_out("udp", "10.0.0.2", 1000 + i, now=i)[1] for i in range(10)]
+    for now in range(90, 65500, 90):
+        for i in range(0, 10, 2):
+            nat.translate_out("udp", "10.0.0.2", 1000 + i, now=now)
+    for i, now in ((0, 65460), (2, 65480), (4, 65500), (6, 65520), (0, 65540)):  # last rebases
+        nat.translate_out("udp", "10.0.0.2", 1000 + i, now=now)
+    log = [nat._epoch, list(nat._ts)]
+    log.append(nat.expire(now=65580))  # 1002 sits exactly on its deadline
+    log.append([nat.translate_in(p, now=65590) for p in ports])
+    log.append(nat.expire(now=65590 + 2 * nt._WHEEL_SPAN))
+    return log
+
+def test_numpy_paths_match_pure_python(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(nt, "_jit_mark_expired", None)
+    vectorized = _rebase_then_jump()
+    monkeypatch.setattr(nt, "_np", None)
+    pure = _rebase_then_jump()
+    assert vectorized == pure
+    assert pure[0] == 65440
+    assert pure[2] == 7
+    assert pure[3] == [("udp", "10.0.0.2", 1000 + i) if i in (0, 4, 6) else None for i in range(10)]
+    assert pure[4] == 3
+
+def test_numba_kernel_matches_pure_python(monkeypatch):
+    pytest.importorskip("numba")
+    assert nt._jit_mark_expired is not None
+    rng = random.Random(5)
+    proto = array("H", [rng.choice((0, 6, 17)) for _ in range(500)])
+    ts = array("H", [rng.randrange(0x10000) for _ in range(497)] + [0, 30000, 0xFFFF])
+    compiled = [nt._stale_rows(proto, ts, limit) for limit in (-1, 0, 30000, 0xFFFF, 10**6)]
+    jitted = _rebase_then_jump()
+    monkeypatch.setattr(nt, "_np", None)
+    assert compiled == [nt._stale_rows(proto, ts, limit) for limit in (-1, 0, 30000, 0xFFFF, 10**6)]
+    assert jitted == _rebase_then_jump()